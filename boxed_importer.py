@@ -1,63 +1,95 @@
-import json
 import logging
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from os import path
 import numpy as np
 import typing as tp
+from dataclasses import dataclass, field
+from itertools import chain
 
 import helpers
 
 
+@dataclass(slots=True, eq=False)
 class Pose:
-    """ Represents a 6-dimensional pose. """
+    """ Represents a 6-dimensional pose. Single precision is used, which is more than enough for the recorded poses. """
 
-    def __init__(self, rotation: list[list[float]], translation: list[float]):
-        self.rotation = np.asarray(rotation)
-        self.translation = np.asarray(translation)
+    rotation: np.ndarray
+    translation: np.ndarray
 
+    def __post_init__(self):
+        self.rotation = np.asarray(self.rotation, dtype=np.float32)
+        self.translation = np.asarray(self.translation, dtype=np.float32)
 
-class PoseWithTime(Pose):
-    """ Represents a 6-dimensional pose with a timestamp in milliseconds, relative to master clock that starts at scene
-    start. """
 
-    def __init__(self, rotation: list[list[float]], translation: list[float], time_stamp: int):
-        super().__init__(rotation, translation)
-        self.time_stamp = time_stamp
+@dataclass(slots=True, eq=False)
+class Trajectory:
+    """ Represents a sequence of 6-dimensional poses with timestamps in milliseconds, relative to master clock that
+    starts at scene start. The poses are stored as one contiguous array per attribute, where the first axis indexes
+    the poses: *rotations* has shape (N, 3, 3), *translations* has shape (N, 3) and *time_stamps* has shape (N,). """
 
+    rotations: np.ndarray
+    translations: np.ndarray
+    time_stamps: np.ndarray
 
+    def __len__(self) -> int:
+        return len(self.time_stamps)
+
+    @classmethod
+    def from_file(cls, traj_file: str) -> 'Trajectory':
+        """ Loads a trajectory from a trajectory file. """
+        records = helpers.load_traj_records(traj_file)
+
+        # Stream the flattened values straight into arrays of known size, so that iterating over them happens in C
+        # rather than in a Python loop over the poses
+        n_poses = len(records)
+        rotations = np.fromiter(chain.from_iterable(chain.from_iterable(record.rotation for record in records)),
+                                dtype=np.float32, count=9 * n_poses).reshape(n_poses, 3, 3)
+        translations = np.fromiter(chain.from_iterable(record.translation for record in records),
+                                   dtype=np.float32, count=3 * n_poses).reshape(n_poses, 3)
+        time_stamps = np.fromiter((record.timeStamp for record in records), dtype=np.int64, count=n_poses)
+        return cls(rotations, translations, time_stamps)
+
+
+@dataclass(slots=True, eq=False)
 class Obj:
     """ Represents an object in the dataset. Includes its name, unique ID, and pick and place pose. """
 
-    def __init__(self):
-        self.name: tp.Optional[str] = None
-        self.unique_id: tp.Optional[int] = None
-        self.pick_pose: tp.Optional[Pose] = None
-        self.place_pose: tp.Optional[Pose] = None
+    name: tp.Optional[str] = None
+    unique_id: tp.Optional[int] = None
+    pick_pose: tp.Optional[Pose] = None
+    place_pose: tp.Optional[Pose] = None
 
     def add_obj_info(self, name: str, pick_rot: list[list[float]], pick_trans: list[float],
                      place_rot: list[list[float]], place_trans: list[float]):
         """ Processes and saves the object's information. """
-        self.name = helpers.get_clean_name(name)
-        self.unique_id = int(name[-4:])  # The last 4 characters are the unique object ID
+        self.name, self.unique_id = helpers.parse_obj_id(name)
         self.pick_pose = Pose(pick_rot, pick_trans)
         self.place_pose = Pose(place_rot, place_trans)
 
 
+@dataclass(slots=True, eq=False)
 class ObjWithTraj(Obj):
     """ Represents an object and its trajectory in the dataset. Extends the *Obj* class to add a trajectory attribute,
-    which is a list of *PoseWithTime* objects. """
+    which is a *Trajectory* object. The trajectory is only read from *traj_file* the first time it is accessed, unless
+    it was loaded explicitly with *add_traj*. """
 
-    def __init__(self):
-        super().__init__()
-        self.trajectory: tp.List[PoseWithTime] = []
+    traj_file: tp.Optional[str] = None
+    _trajectory: tp.Optional[Trajectory] = field(default=None, init=False, repr=False)
+
+    @property
+    def trajectory(self) -> tp.Optional[Trajectory]:
+        """ The object's trajectory, or None if it has no trajectory file. """
+        if self._trajectory is None and self.traj_file is not None:
+            self._trajectory = Trajectory.from_file(self.traj_file)
+        return self._trajectory
 
     def add_traj(self, traj_file: str):
         """ Loads a trajectory from a trajectory file. """
-        with open(traj_file) as f:
-            data = json.load(f)
-
-        for pose_time in data:
-            self.trajectory.append(PoseWithTime(pose_time['rotation'], pose_time['translation'],
-                                                pose_time['timeStamp']))
+        self.traj_file = traj_file
+        self._trajectory = Trajectory.from_file(traj_file)
 
 
 class Scene:
@@ -65,18 +97,28 @@ class Scene:
     this scene, the order in which they were packed (not explicitly, but it matches the order in which they are saved in
     the objects list) and the grasp and placement poses. """
 
+    __slots__ = ('scene_num', 'initial_objs', 'objs_info', 'cam_traj_file', '_cam_traj')
+
     def __init__(self):
         self.scene_num: tp.Optional[int] = None
         self.initial_objs: tp.List[str] = []
         self.objs_info: tp.List[ObjWithTraj] = []
-        self.cam_traj: tp.List[PoseWithTime] = []
+        self.cam_traj_file: tp.Optional[str] = None
+        self._cam_traj: tp.Optional[Trajectory] = None
+
+    @property
+    def cam_traj(self) -> tp.Optional[Trajectory]:
+        """ The camera trajectory of this scene, read from *cam_traj_file* the first time it is accessed. None if camera
+        trajectories were not requested. """
+        if self._cam_traj is None and self.cam_traj_file is not None:
+            self._cam_traj = Trajectory.from_file(self.cam_traj_file)
+        return self._cam_traj
 
     def add_objects(self, scene_file: str, scene_number: int):
         """ Loads the PickPlace file of each scene. The order of the objects is preserved. """
         self.scene_num = scene_number
 
-        with open(scene_file) as f:
-            data = json.load(f)
+        data = helpers.load_json(scene_file)
 
         # For each object in the PickPlace file, load its name, pick and place poses into an ObjWithTraj object (the
         # trajectory of the object is loaded afterwards)
@@ -86,28 +128,25 @@ class Scene:
                                  obj_data['placeRotation'], obj_data['placeTranslation'])
             self.objs_info.append(new_obj)
 
-    def add_obj_traj(self, scene_files: list[str]):
-        """ Loads the trajectory of each object in the scene. """
-        for obj in self.objs_info:
-            for file in scene_files:
-                # Search for the trajectory file that corresponds to this object
-                if obj.name in file:
-                    obj.add_traj(file)
-                    break
+    def get_obj_traj_files(self, scene_files: list[str]) -> list[tuple[ObjWithTraj, str]]:
+        """ Matches each object in the scene to its trajectory file. Objects without a trajectory file are skipped. """
+        # Index the files by object name. If several files have the same name, the first one is used
+        name_to_file = {}
+        for file in scene_files:
+            name_to_file.setdefault(helpers.get_traj_obj_name(file), file)
+        return [(obj, name_to_file[obj.name]) for obj in self.objs_info if obj.name in name_to_file]
 
     def add_cam_traj(self, cam_traj_file: str):
         """ Loads the camera trajectory file of this scene. """
-        with open(cam_traj_file) as f:
-            data = json.load(f)
-
-        for cam_pose_time in data:
-            self.cam_traj.append(PoseWithTime(cam_pose_time.rotation, cam_pose_time.translation,
-                                              cam_pose_time.timeStamp))
+        self.cam_traj_file = cam_traj_file
+        self._cam_traj = Trajectory.from_file(cam_traj_file)
 
 
 class Participant:
     """ Contains all the scenes (sets of objects) that a participant packed in the box."""
 
+    __slots__ = ('part_num', 'scenes')
+
     def __init__(self):
         self.part_num: tp.Optional[int] = None  # Participant number
         self.scenes: tp.List[Scene] = []
@@ -129,25 +168,46 @@ class Participant:
             self.scenes.append(new_scene)
 
     def add_trajectories(self, part_files: list[str], part_scene_nums: list[tuple[int, int]],
-                         cam_part_files=None, cam_part_scene_nums=None) -> None:
+                         cam_part_files=None, cam_part_scene_nums=None, lazy=True) -> None:
         """
-        Loads the trajectories of all the objects corresponding to this participant.
+        Assigns the trajectory files of all the objects corresponding to this participant, and optionally loads them.
 
         :param part_files: All the objects' trajectory files corresponding to this Participant.
         :param part_scene_nums: The participant and scene numbers in the same order as the object files.
         :param cam_part_files: (optional) All the camera's trajectory files corresponding to this Participant.
         :param cam_part_scene_nums: (optional) The participant and scene numbers in the same order as the camera files.
+        :param lazy: If set to True the trajectories are only loaded when they are first accessed, otherwise they are
+        all loaded now.
         """
 
-        # Get the files that correspond to each scene
-        aux_scene_nums = np.asarray([x[1] for x in part_scene_nums])
+        # Group the files by scene in a single pass and match them to the objects (and camera) of each scene
+        scene_files = defaultdict(list)
+        for part_file, part_scene_num in zip(part_files, part_scene_nums):
+            scene_files[part_scene_num[1]].append(part_file)
+        obj_files = []
         for scene in self.scenes:
-            scene_files = [i for (i, v) in zip(part_files, aux_scene_nums == scene.scene_num) if v]
-            scene.add_obj_traj(scene_files)
-            # Verify whether to load the camera trajectory or not
-            if cam_part_files is not None:
-                # Get the camera trajectory file (only one file) corresponding to this participant and scene
-                scene.add_cam_traj(cam_part_files[cam_part_scene_nums.index((self.part_num, scene.scene_num))])
+            obj_files.extend(scene.get_obj_traj_files(scene_files[scene.scene_num]))
+        # Verify whether to load the camera trajectories or not
+        cam_files = []
+        if cam_part_files is not None:
+            # Get the camera trajectory file (only one file) corresponding to this participant and each scene
+            cam_scene_files = {part_scene_num[1]: cam_file
+                               for cam_file, part_scene_num in zip(cam_part_files, cam_part_scene_nums)}
+            cam_files = [cam_scene_files[scene.scene_num] for scene in self.scenes]
+
+        if lazy:
+            for obj, file in obj_files:
+                obj.traj_file = file
+            for scene, file in zip(self.scenes, cam_files):
+                scene.cam_traj_file = file
+            return
+
+        # Every file can be loaded independently, so load them concurrently
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = [executor.submit(obj.add_traj, file) for obj, file in obj_files]
+            futures += [executor.submit(scene.add_cam_traj, file) for scene, file in zip(self.scenes, cam_files)]
+            for future in futures:
+                future.result()  # Re-raises any exception that occurred while loading the file
 
 
 class BoxED:
@@ -156,9 +216,10 @@ class BoxED:
     loading dataset from folder, reading specific attributes of the dataset, and more.
 
     A *BoxED* object stores the path to the root folder of the dataset, a flag that signals whether camera
-    trajectories should be loaded or not (they are very large) and a list of *Participant* objects. Each participant
-    stores its number and a list of *Scene* objects. A scene is a set of objects that the participant packed into the
-    box. Each *Scene* object stores all the information of the objects in it.
+    trajectories should be loaded or not (they are very large), a flag that signals whether trajectories are only read
+    from their files when first accessed, and a list of *Participant* objects. Each participant stores its number and a
+    list of *Scene* objects. A scene is a set of objects that the participant packed into the box. Each *Scene* object
+    stores all the information of the objects in it.
     """
 
     UNIQ_OBJS = 26
@@ -173,12 +234,14 @@ class BoxED:
                 "103 toothpaste"]
     """ List of all object's names. """
 
-    def __init__(self, root_folder: str, load_cam_traj=False):
+    def __init__(self, root_folder: str, load_cam_traj=False, lazy_traj=True):
         """
         Reads and loads the dataset (may take a few moments to finish).
 
         :param root_folder: Folder where the dataset is located
         :param load_cam_traj: Whether to load_pick_place the camera trajectories or not.
+        :param lazy_traj: If set to True (default) each trajectory file is only read the first time that trajectory is
+        accessed. Otherwise, all the trajectories are loaded upfront.
         """
         logging.basicConfig(format='BoxED %(levelname)s: %(message)s', level=logging.INFO)
         self.participants: tp.List[Participant] = []
@@ -192,6 +255,7 @@ class BoxED:
 
         self.root_folder = root_folder  # The root folder where the dataset is stored
         self.load_cam_traj = load_cam_traj
+        self.lazy_traj = lazy_traj
         self.load_pick_place()
         self.load_trajectories()
 
@@ -218,33 +282,28 @@ class BoxED:
         self.participants.append(new_participant)
 
     def load_trajectories(self):
-        """ Loads all object trajectories in the dataset. """
+        """ Loads all object trajectories in the dataset (or only locates their files, if *lazy_traj* is set). """
         trajectory_files, part_scene_nums = helpers.file_crawler(root_folder=self.root_folder,
                                                                  target_filename='trajectory')
-        # Get the files that correspond to each participant
-        aux_part_nums = np.asarray([x[0] for x in part_scene_nums])
-        for part in self.participants:
-            part_files = [i for (i, v) in zip(trajectory_files, aux_part_nums == part.part_num) if v]
-            part_nums = [i for (i, v) in zip(part_scene_nums, aux_part_nums == part.part_num) if v]
-
-            # Separate object trajectory files from camera trajectory files. This is done by adding camera trajectory
-            # files to a new list and saving their indexes to a list to remove them from the original part/scenes
-            # numbers list and files list
-            cam_part_files, cam_part_nums, pop_idxs = [], [], []
-            for i, (part_file, part_num) in enumerate(zip(part_files, part_nums)):
-                if "main_camera_trajectory" in part_file:
-                    cam_part_files.append(part_file)
-                    cam_part_nums.append(part_num)
-                    pop_idxs.append(i)
-            for index in sorted(pop_idxs, reverse=True):
-                del part_nums[index]
-                del part_files[index]
+        # Group the files by participant in a single pass, separating object trajectory files from camera trajectory
+        # files
+        part_files, part_nums = defaultdict(list), defaultdict(list)
+        cam_part_files, cam_part_nums = defaultdict(list), defaultdict(list)
+        for traj_file, part_scene_num in zip(trajectory_files, part_scene_nums):
+            if "main_camera_trajectory" in traj_file:
+                cam_part_files[part_scene_num[0]].append(traj_file)
+                cam_part_nums[part_scene_num[0]].append(part_scene_num)
+            else:
+                part_files[part_scene_num[0]].append(traj_file)
+                part_nums[part_scene_num[0]].append(part_scene_num)
 
+        for part in self.participants:
             # Add this participant's trajectories
             if self.load_cam_traj:
-                part.add_trajectories(part_files, part_nums, cam_part_files, cam_part_nums)
+                part.add_trajectories(part_files[part.part_num], part_nums[part.part_num],
+                                      cam_part_files[part.part_num], cam_part_nums[part.part_num], lazy=self.lazy_traj)
             else:
-                part.add_trajectories(part_files, part_nums)
+                part.add_trajectories(part_files[part.part_num], part_nums[part.part_num], lazy=self.lazy_traj)
 
     def get_sequences(self, unique_objs_only=False, start_token=False) -> list[list[str]]:
         """
@@ -271,13 +330,12 @@ class BoxED:
 
     def get_scene_durations(self) -> list[int]:
         """ Returns all the durations in milliseconds of each scene (i.e., of each box-packing). """
-        durations = []
-        for participant in self.participants:
-            for scene in participant.scenes:
-                durations.append(scene.objs_info[-1].trajectory[-1].time_stamp -
-                                 scene.objs_info[0].trajectory[0].time_stamp)
+        durations = np.fromiter((scene.objs_info[-1].trajectory.time_stamps[-1] -
+                                 scene.objs_info[0].trajectory.time_stamps[0]
+                                 for participant in self.participants for scene in participant.scenes),
+                                dtype=np.int64)
 
-        return durations
+        return durations.tolist()
 
     def get_grasp_poses(self, grasp_type: str, objs: tp.Union[str, list[str]] = 'all') -> dict[str, list[Pose]]:
         """
@@ -315,15 +373,12 @@ class BoxED:
             logging.error("objs must be either: 'all' for all the objects, a list of object names or an object name.")
             exit(1)
 
+        target_set = frozenset(sys.intern(obj_name) for obj_name in target_objs)
+        pose_attr = 'pick_pose' if grasp_type == 'pick' else 'place_pose'
         for participant in self.participants:
             for scene in participant.scenes:
                 for obj in scene.objs_info:
-                    if obj.name in target_objs:
-                        # Object not yet in dictionary, create Pose list for it
-                        if obj.name not in grasp_poses:
-                            grasp_poses[obj.name] = [obj.pick_pose] if grasp_type == 'pick' else [obj.place_pose]
-                        # Object already in dictionary, simply append the new pose to its list
-                        else:
-                            grasp_poses[obj.name].append(obj.pick_pose if grasp_type == 'pick' else obj.place_pose)
+                    if obj.name in target_set:
+                        grasp_poses.setdefault(obj.name, []).append(getattr(obj, pose_attr))
 
         return grasp_poses
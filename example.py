@@ -1,7 +1,7 @@
 """
 This file contains an example of how to import BoxED using the object-oriented framework in boxed_importer.py
 
-This script was developed and tested with Python 3.9, but should be compatible with other versions.
+This script requires Python 3.10 or newer (the importer uses slotted dataclasses).
 """
 from boxed_importer import BoxED
 
@@ -1,6 +1,44 @@
+import json
+import mmap
 import os
 import re
-from typing import Tuple, List
+import sys
+from typing import Tuple, List, NamedTuple
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the (slower) standard library parser
+    orjson = None
+try:
+    import msgspec
+except ImportError:  # msgspec is optional, fall back to parsing trajectory files with load_json
+    msgspec = None
+
+# Matches the integers in a path, i.e., the participant and scene numbers
+_DIGITS = re.compile(r'\d+')
+# Matches the first character of the portion of an object ID that follows its name
+_CLEAN_NAME_END = re.compile(r'[(\-]')
+# Splits an object ID into its name and the last 4 digits, which are the unique object ID
+_OBJ_ID = re.compile(r'^(.*?)[(\-].*?(\d{4})$')
+# Matches the suffix that is appended to the object ID in the name of object trajectory files
+_TRAJ_SUFFIX = re.compile(r'_trajectory.*$')
+
+
+# A single timestamped pose, as stored in trajectory files. When msgspec is available the poses are decoded straight
+# into these typed records, otherwise they are built from the parsed dicts
+if msgspec is not None:
+    class PoseRecord(msgspec.Struct):
+        rotation: list[list[float]]
+        translation: list[float]
+        timeStamp: int
+
+    # Decoders are reusable and thread-safe, so a single one is shared by all trajectory files
+    _TRAJ_DECODER = msgspec.json.Decoder(list[PoseRecord])
+else:
+    class PoseRecord(NamedTuple):
+        rotation: list[list[float]]
+        translation: list[float]
+        timeStamp: int
 
 
 def file_crawler(root_folder: str, target_filename: str, uniq_seqs=False) -> tuple[list[str], list[tuple[int, int]]]:
@@ -11,42 +49,99 @@ def file_crawler(root_folder: str, target_filename: str, uniq_seqs=False) -> tup
     :param uniq_seqs: (For PickPlace sequences only) If set to True, only the sequences with unique objects only are
     returned.
     """
-    all_file_paths = []
-    part_scene_nums = []
-    for path, subdirs, files in os.walk(root_folder):
-        for name in files:
-            if target_filename in name:
-                # Get the participant and scene number
-                part_scene_number = tuple(int(s) for s in re.findall(r'\d+', path))
-
-                # If only uniq_seqs are requested, verify that it's the 1st scene and the participant number is greater
-                # than 25 (only those have unique objects in the 1st scene), before adding path to list
-                if uniq_seqs and (part_scene_number[1] != 1 or part_scene_number[0] < 26):
-                    continue
-
-                all_file_paths.append(os.path.join(path, name))
-                part_scene_nums.append(part_scene_number)
-
-    # Sort paths along participant number and scene number
-    # all_file_paths.sort(key=lambda path: tuple(int(s) for s in re.findall(r'\d+', path)))
-    all_file_paths = [x for _, x in sorted(zip(part_scene_nums, all_file_paths))]
-    part_scene_nums = [x for x, _ in sorted(zip(part_scene_nums, all_file_paths))]
+    dir_files = []  # The participant and scene number of each directory, along with the paths to its files
+    for path, file_paths in _scan_tree(root_folder, target_filename):
+        if not file_paths:
+            continue
+        # Get the participant and scene number (the same for all files in this directory)
+        part_scene_number = tuple(map(int, _DIGITS.findall(path)))
+
+        # If only uniq_seqs are requested, verify that it's the 1st scene and the participant number is greater than 25
+        # (only those have unique objects in the 1st scene), before adding paths to list
+        if uniq_seqs and (part_scene_number[1] != 1 or part_scene_number[0] < 26):
+            continue
+
+        dir_files.append((part_scene_number, sorted(file_paths)))
+
+    # Sort paths along participant number and scene number. All files in a directory share these numbers, so only the
+    # (far fewer) directories need to be sorted
+    dir_files.sort()
+    all_file_paths = [file_path for _, file_paths in dir_files for file_path in file_paths]
+    part_scene_nums = [part_scene_number for part_scene_number, file_paths in dir_files for _ in file_paths]
     return all_file_paths, part_scene_nums
 
 
+def _scan_tree(folder: str, target_filename: str):
+    """ Yields every directory in the tree rooted at *folder* (symbolic links to directories are not followed), along
+    with the paths to its files whose name contains *target_filename*. """
+    file_paths, subdirs = [], []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(entry.path)
+            elif target_filename in entry.name:
+                file_paths.append(entry.path)
+
+    yield folder, file_paths
+    for subdir in subdirs:
+        yield from _scan_tree(subdir, target_filename)
+
+
 def get_clean_name(name: str) -> str:
     """
     Removes the portions of the name that contain brackets, integer IDs, etc.
 
     Eg: *010 box(clone)-29932* becomes *010 box*
     """
-    # Delete the portion of the ID string that may have "(clone)" and/or the unique integer identifier)
-    idx1 = name.find('(')
-    idx2 = name.find('-')
-    delete_idx = len(name)
+    # Delete the portion of the ID string that may have "(clone)" and/or the unique integer identifier
+    # Names are interned since there are only a few distinct ones, shared by thousands of objects
+    match = _CLEAN_NAME_END.search(name)
+    return sys.intern(name[:match.start()] if match else name)
+
+
+def parse_obj_id(obj_id: str) -> tuple[str, int]:
+    """
+    Splits an object ID into the object's clean name (see *get_clean_name*) and its unique integer identifier, which
+    is given by the last 4 characters of the ID.
+
+    Eg: *010 box(clone)-29932* becomes *(010 box, 9932)*
+    """
+    match = _OBJ_ID.match(obj_id)
+    if match is None:
+        return get_clean_name(obj_id), int(obj_id[-4:])
+    return sys.intern(match.group(1)), int(match.group(2))
+
+
+def get_traj_obj_name(file_path: str) -> str:
+    """
+    Returns the clean name of the object whose trajectory is stored in *file_path*.
+
+    Eg: *.../010 box(clone)-29932_trajectory.json* becomes *010 box*
+    """
+    return get_clean_name(_TRAJ_SUFFIX.sub('', os.path.basename(file_path)))
+
+
+def load_json(file_path: str):
+    """ Reads and parses a JSON file. Uses orjson if it is installed, since it is considerably faster than the standard
+    library parser. In that case the file is memory-mapped and parsed in place, instead of being copied into a bytes
+    object first. """
+    if orjson is None:
+        with open(file_path, 'rb') as f:
+            return json.load(f)
+    return _parse_mapped(file_path, orjson.loads)
+
+
+def load_traj_records(file_path: str) -> list[PoseRecord]:
+    """ Reads and parses a trajectory file into a list of *PoseRecord*. Uses msgspec if it is installed, which decodes
+    the file without building an intermediate dict for each pose and uses less memory while doing so. """
+    if msgspec is None:
+        return [PoseRecord(pose_time['rotation'], pose_time['translation'], pose_time['timeStamp'])
+                for pose_time in load_json(file_path)]
+    return _parse_mapped(file_path, _TRAJ_DECODER.decode)
 
-    # Get the smallest positive integer from idx1 and idx2
-    if idx1 != -1 or idx2 != -1:
-        delete_idx = min(idx1, idx2) if min(idx1, idx2) > 0 else max(idx1, idx2)
 
-    return name[0:delete_idx]
+def _parse_mapped(file_path: str, parse):
+    """ Memory-maps a file and parses it in place with *parse*. """
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as buf:
+        return parse(buf)